@@ -1,9 +1,21 @@
+import atexit
 import configparser
 from configparser import ConfigParser
 from dataclasses import dataclass
+import functools
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
 import re
 import boto3
-from typing import Pattern
+from typing import Dict, Pattern
+
+
+# Local cache for facts about AWS resources which rarely change between script invocations
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'etl')
+IAM_ROLE_ARN_CACHE_PATH = os.path.join(CACHE_DIR, 'iam_arns.json')
 
 
 @dataclass
@@ -17,10 +29,21 @@ class Manifest:
 class DataSet:
     bucket_name: str
     song_data_prefix: str
-    song_data_regex_pattern: Pattern[str]
+    song_data_regex_pattern: str
     log_data_prefix: str
-    log_data_regex_pattern: Pattern[str]
+    log_data_regex_pattern: str
     log_data_json_path_key: str
+    compression: str
+
+    # Keep only pattern sources as fields so that `DataSet` stays plain data (e.g. picklable, cheap to compare),
+    # and compile them on first use.
+    @functools.cached_property
+    def song_data_regex(self) -> Pattern[str]:
+        return re.compile(self.song_data_regex_pattern)
+
+    @functools.cached_property
+    def log_data_regex(self) -> Pattern[str]:
+        return re.compile(self.log_data_regex_pattern)
 
 
 @dataclass
@@ -44,8 +67,57 @@ class EtlConfig:
     redshift_cluster: RedshiftCluster
 
 
+@functools.lru_cache(maxsize=1)
+def configure_logging() -> None:
+    """
+    Configure root logger to emit through a queue drained by a background thread, so threads busy with DB
+    never block on log I/O. Calling it more than once is no-op.
+
+        Returns:
+            None
+    """
+    log_queue = queue.Queue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s'))
+    listener = QueueListener(log_queue, stream_handler)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    listener.start()
+    # Flush queued records before interpreter exits.
+    atexit.register(listener.stop)
+
+
+# Building boto3 session/clients loads service models from disk, so build them at most once per process.
+@functools.lru_cache(maxsize=1)
+def get_session() -> boto3.session.Session:
+    return boto3.session.Session()
+
+
+@functools.lru_cache(maxsize=1)
+def get_redshift_client():
+    return get_session().client('redshift')
+
+
+@functools.lru_cache(maxsize=1)
+def get_iam_client():
+    return get_session().client('iam')
+
+
+@functools.lru_cache(maxsize=1)
+def get_s3_resource():
+    return get_session().resource('s3')
+
+
+@functools.lru_cache(maxsize=1)
+def get_ec2_resource():
+    return get_session().resource('ec2')
+
+
 def get_static_config_instance() -> EtlConfig:
-    region_name = boto3.session.Session().region_name
+    region_name = get_session().region_name
 
     config: ConfigParser = configparser.ConfigParser()
     config.read('dwh.cfg')
@@ -58,10 +130,11 @@ def get_static_config_instance() -> EtlConfig:
     data_set = DataSet(
         bucket_name=config['DATA_SET'].get('BUCKET_NAME'),
         song_data_prefix=config['DATA_SET'].get('SONG_DATA_PREFIX'),
-        song_data_regex_pattern=re.compile(config['DATA_SET'].get('SONG_DATA_REGEX_PATTERN')),
+        song_data_regex_pattern=config['DATA_SET'].get('SONG_DATA_REGEX_PATTERN'),
         log_data_prefix=config['DATA_SET'].get('LOG_DATA_PREFIX'),
-        log_data_regex_pattern=re.compile(config['DATA_SET'].get('LOG_DATA_REGEX_PATTERN')),
-        log_data_json_path_key=config['DATA_SET'].get('LOG_DATA_JSON_PATH_KEY')
+        log_data_regex_pattern=config['DATA_SET'].get('LOG_DATA_REGEX_PATTERN'),
+        log_data_json_path_key=config['DATA_SET'].get('LOG_DATA_JSON_PATH_KEY'),
+        compression=config['DATA_SET'].get('COMPRESSION', '')
     )
     redshift_cluster = RedshiftCluster(
         db_name=config['CLUSTER'].get('DB_NAME'),
@@ -83,6 +156,17 @@ def get_static_config_instance() -> EtlConfig:
     )
 
 
+def build_conn_string(etl_config: EtlConfig, cluster_endpoint: str) -> str:
+    # https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING
+    return 'host={endpoint} dbname={db_name} user={db_user} password={db_password} port={db_port}'.format(
+        db_user=etl_config.redshift_cluster.db_user,
+        db_password=etl_config.redshift_cluster.db_password,
+        endpoint=cluster_endpoint,
+        db_port=etl_config.redshift_cluster.db_port,
+        db_name=etl_config.redshift_cluster.db_name
+    )
+
+
 def get_cluster_endpoint(redshift_client, etl_config: EtlConfig) -> str:
     cluster_props = redshift_client.describe_clusters(
         ClusterIdentifier=etl_config.redshift_cluster.cluster_identifier
@@ -91,5 +175,54 @@ def get_cluster_endpoint(redshift_client, etl_config: EtlConfig) -> str:
     return cluster_props['Endpoint']['Address']
 
 
-def get_iam_role_arn(iam_client, iam_role_name: str) -> str:
-    return iam_client.get_role(RoleName=iam_role_name)['Role']['Arn']
+def get_dwh_conn_string(etl_config: EtlConfig) -> str:
+    """
+    Build DB connection string of Redshift cluster described by ETL configuration
+
+        Parameters:
+            etl_config: ETL application configuration
+
+        Returns:
+            conn_string: DB connection string
+    """
+    cluster_endpoint = get_cluster_endpoint(get_redshift_client(), etl_config=etl_config)
+
+    return build_conn_string(etl_config, cluster_endpoint=cluster_endpoint)
+
+
+@functools.lru_cache(maxsize=1)
+def load_iam_role_arn_cache() -> Dict[str, str]:
+    try:
+        with open(IAM_ROLE_ARN_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_iam_role_arn(iam_client, iam_role_name: str, refresh: bool = False) -> str:
+    """
+    Get IAM role ARN from particular IAM role name. Role ARN is stable, so it is cached on disk across invocations.
+
+        Parameters:
+            iam_client: IAM client
+            iam_role_name: IAM role name
+            refresh: whether to bypass cached role ARN and look it up again
+
+        Returns:
+            iam_role_arn: IAM role ARN
+    """
+    # The same role name may exist in accounts behind different AWS profiles.
+    cache_key = f'{get_session().profile_name}:{iam_role_name}'
+    iam_role_arn_cache = load_iam_role_arn_cache()
+
+    if not refresh and cache_key in iam_role_arn_cache:
+        return iam_role_arn_cache[cache_key]
+
+    iam_role_arn = iam_client.get_role(RoleName=iam_role_name)['Role']['Arn']
+    iam_role_arn_cache[cache_key] = iam_role_arn
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(IAM_ROLE_ARN_CACHE_PATH, 'w') as f:
+        json.dump(iam_role_arn_cache, f)
+
+    return iam_role_arn
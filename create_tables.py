@@ -1,22 +1,32 @@
-import boto3
+from typing import List
+
 import psycopg2
 
-from common import get_cluster_endpoint, get_static_config_instance, EtlConfig
+from common import get_dwh_conn_string, get_static_config_instance, EtlConfig
 from sql_queries import create_table_queries, drop_table_queries
 
 
-def drop_tables(cur, conn) -> None:
+def execute_queries_in_batch(cur, conn, queries: List[str]) -> None:
     """
-    Drop tables defined in `drop_table_queries`.
+    Execute queries in one round trip and commit once. On failure, re-run them one by one to find the culprit.
 
         Parameters:
             cur: active DB cursor
             conn: active DB connection
+            queries: queries to be executed in order
 
         Returns:
             None
     """
-    for query in drop_table_queries:
+    try:
+        cur.execute(';\n'.join(queries))
+        conn.commit()
+        return
+    except Exception as e:
+        print(f'There is an exception when executing queries in batch. Re-run them one by one. Exception = {e}')
+        conn.rollback()
+
+    for query in queries:
         try:
             cur.execute(query)
             conn.commit()
@@ -25,6 +35,20 @@ def drop_tables(cur, conn) -> None:
             raise e
 
 
+def drop_tables(cur, conn) -> None:
+    """
+    Drop tables defined in `drop_table_queries`.
+
+        Parameters:
+            cur: active DB cursor
+            conn: active DB connection
+
+        Returns:
+            None
+    """
+    execute_queries_in_batch(cur, conn, drop_table_queries)
+
+
 def create_tables(cur, conn) -> None:
     """
         Create tables defined in `create_table_queries`.
@@ -36,37 +60,33 @@ def create_tables(cur, conn) -> None:
             Returns:
                 None
         """
-    for query in create_table_queries:
-        try:
-            cur.execute(query)
-            conn.commit()
-        except Exception as e:
-            print(f'There is an exception when executing query = {query}')
-            raise e
+    execute_queries_in_batch(cur, conn, create_table_queries)
 
 
-def main():
-    etl_config: EtlConfig = get_static_config_instance()
-
-    redshift_client = boto3.client('redshift')
+def recreate_tables(conn) -> None:
+    """
+    Drop tables, then create them again.
 
-    cluster_endpoint = get_cluster_endpoint(redshift_client, etl_config=etl_config)
+        Parameters:
+            conn: active DB connection
 
-    # https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING
-    conn_string = 'host={endpoint} dbname={db_name} user={db_user} password={db_password} port={db_port}'.format(
-        db_user=etl_config.redshift_cluster.db_user,
-        db_password=etl_config.redshift_cluster.db_password,
-        endpoint=cluster_endpoint,
-        db_port=etl_config.redshift_cluster.db_port,
-        db_name=etl_config.redshift_cluster.db_name
-    )
-    conn = psycopg2.connect(conn_string)
+        Returns:
+            None
+    """
     cur = conn.cursor()
 
     drop_tables(cur, conn)
     create_tables(cur, conn)
 
-    conn.close()
+
+def main():
+    etl_config: EtlConfig = get_static_config_instance()
+
+    conn = psycopg2.connect(get_dwh_conn_string(etl_config))
+    try:
+        recreate_tables(conn)
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
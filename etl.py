@@ -1,11 +1,26 @@
+import argparse
+import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
-import boto3
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 
-from common import get_cluster_endpoint, get_iam_role_arn, get_static_config_instance, EtlConfig
-from sql_queries import build_copy_table_queries, insert_table_queries
+from common import (
+    configure_logging,
+    get_dwh_conn_string,
+    get_iam_client,
+    get_iam_role_arn,
+    get_static_config_instance,
+    EtlConfig
+)
+from sql_queries import build_copy_table_queries, dimension_table_insert_queries, fact_table_insert_queries
+
+logger = logging.getLogger(__name__)
+
+# `ThreadedConnectionPool.getconn` fails instead of blocking when exhausted, so size pool and workers the same.
+MAX_INSERT_CONCURRENCY = max(len(dimension_table_insert_queries), len(fact_table_insert_queries))
 
 
 def load_staging_tables(cur, conn, etl_config: EtlConfig, dwh_iam_role_arn: str) -> None:
@@ -24,65 +39,125 @@ def load_staging_tables(cur, conn, etl_config: EtlConfig, dwh_iam_role_arn: str)
     copy_table_queries: List[str] = build_copy_table_queries(etl_config=etl_config, dwh_iam_role_arn=dwh_iam_role_arn)
     for query in copy_table_queries:
         try:
-            print(f'Start executing query = {query}')
+            logger.info('Start executing query = %s', query)
             start_epoch = time.time()
             cur.execute(query)
             conn.commit()
             end_epoch = time.time()
-            print(f'Spent {int(end_epoch - start_epoch)} seconds on executing query = {query}')
+            logger.info('Spent %.2f seconds on executing query = %s', end_epoch - start_epoch, query)
         except Exception as e:
-            print(f'There is an exception when executing query = {query}')
+            logger.error('There is an exception when executing query = %s', query)
             raise e
 
 
-def insert_tables(cur, conn) -> None:
+def execute_query_from_pool(pool: ThreadedConnectionPool, query: str) -> None:
     """
-    Insert data to fact and dimensional tables according to `insert_table_queries`
+    Execute and commit query on a connection borrowed from connection pool
+
+        Parameters:
+            pool: DB connection pool
+            query: query to be executed
+
+        Returns:
+            None
+    """
+    conn = pool.getconn()
+    try:
+        # Each query is committed explicitly below.
+        conn.autocommit = False
+        cur = conn.cursor()
+        logger.info('Start executing query = %s', query)
+        start_epoch = time.time()
+        cur.execute(query)
+        conn.commit()
+        end_epoch = time.time()
+        logger.info('Spent %.2f seconds on executing query = %s', end_epoch - start_epoch, query)
+    except Exception as e:
+        logger.error('There is an exception when executing query = %s', query)
+        raise e
+    finally:
+        pool.putconn(conn)
+
+
+def create_insert_connection_pool(conn_string: str) -> ThreadedConnectionPool:
+    """
+    Create DB connection pool large enough for `insert_tables`
+
+        Parameters:
+            conn_string: DB connection string
+
+        Returns:
+            pool: DB connection pool
+    """
+    return ThreadedConnectionPool(minconn=1, maxconn=MAX_INSERT_CONCURRENCY, dsn=conn_string)
+
+
+def insert_tables(pool: ThreadedConnectionPool) -> None:
+    """
+    Insert data to fact and dimensional tables according to `dimension_table_insert_queries` and
+    `fact_table_insert_queries`. Queries within each group run concurrently on their own connections.
 
        Parameters:
-           cur: active DB cursor
-           conn: active DB connection
+           pool: DB connection pool (see `create_insert_connection_pool`)
 
        Returns:
            None
     """
-    for query in insert_table_queries:
-        try:
-            print(f'Start executing query = {query}')
-            start_epoch = time.time()
-            cur.execute(query)
-            conn.commit()
-            end_epoch = time.time()
-            print(f'Spent {int(end_epoch - start_epoch)} seconds on executing query = {query}')
-        except Exception as e:
-            print(f'There is an exception when executing query = {query}')
-            raise e
+    with ThreadPoolExecutor(max_workers=MAX_INSERT_CONCURRENCY) as executor:
+        # Fact tables refer to dimension tables, so wait for all dimension inserts before inserting facts.
+        for queries in [dimension_table_insert_queries, fact_table_insert_queries]:
+            futures = [executor.submit(execute_query_from_pool, pool, query) for query in queries]
+            for future in futures:
+                future.result()
 
 
-def main() -> None:
-    etl_config: EtlConfig = get_static_config_instance()
+def add_etl_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--refresh-iam', action='store_true', help='look IAM role ARN up again instead of cached one')
 
-    iam_client = boto3.client('iam')
-    redshift_client = boto3.client('redshift')
 
-    dwh_iam_role_arn = get_iam_role_arn(iam_client, iam_role_name=etl_config.redshift_cluster.iam_role_name)
-    cluster_endpoint = get_cluster_endpoint(redshift_client, etl_config=etl_config)
+def run_etl(conn, conn_string: str, etl_config: EtlConfig, refresh_iam: bool = False) -> None:
+    """
+    Load raw data to staging tables, then insert data to fact and dimensional tables
 
-    # https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-CONNSTRING
-    conn_string = 'host={endpoint} dbname={db_name} user={db_user} password={db_password} port={db_port}'.format(
-        db_user=etl_config.redshift_cluster.db_user,
-        db_password=etl_config.redshift_cluster.db_password,
-        endpoint=cluster_endpoint,
-        db_port=etl_config.redshift_cluster.db_port,
-        db_name=etl_config.redshift_cluster.db_name
+        Parameters:
+            conn: active DB connection used for loading staging tables
+            conn_string: DB connection string used for inserting final tables concurrently
+            etl_config: ETL application configuration
+            refresh_iam: whether to bypass cached IAM role ARN and look it up again
+
+        Returns:
+            None
+    """
+    dwh_iam_role_arn = get_iam_role_arn(
+        get_iam_client(),
+        iam_role_name=etl_config.redshift_cluster.iam_role_name,
+        refresh=refresh_iam
     )
-    conn = psycopg2.connect(conn_string)
-    cur = conn.cursor()
 
-    load_staging_tables(cur, conn, etl_config=etl_config, dwh_iam_role_arn=dwh_iam_role_arn)
-    insert_tables(cur, conn)
+    load_staging_tables(conn.cursor(), conn, etl_config=etl_config, dwh_iam_role_arn=dwh_iam_role_arn)
+
+    # Open pooled connections only now, so that they do not sit idle while staging tables are loaded.
+    pool = create_insert_connection_pool(conn_string)
+    try:
+        insert_tables(pool)
+    finally:
+        pool.closeall()
+
 
-    conn.close()
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load data from S3 to Redshift staging tables, then final tables')
+    add_etl_arguments(parser)
+    args = parser.parse_args()
+
+    configure_logging()
+    etl_config: EtlConfig = get_static_config_instance()
+
+    conn_string = get_dwh_conn_string(etl_config)
+    conn = psycopg2.connect(conn_string)
+    try:
+        run_etl(conn, conn_string, etl_config=etl_config, refresh_iam=args.refresh_iam)
+    finally:
+        conn.close()
 
 
 if __name__ == "__main__":
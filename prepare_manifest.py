@@ -1,108 +1,172 @@
-import json
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from typing import List, Optional, Pattern
 
-import boto3
 import botocore
+import orjson
+from boto3.s3.transfer import TransferConfig
 
-from common import get_static_config_instance, EtlConfig
+from common import get_s3_resource, get_static_config_instance, EtlConfig, CACHE_DIR
 
 
-@dataclass
-class S3ManifestEntry:
-    url: str
-    mandatory: bool
+# Redshift recommends data files between 1 MB and 1 GB (after compression) so that COPY spreads evenly across slices.
+# Ref: https://docs.aws.amazon.com/redshift/latest/dg/t_splitting-data-files.html
+MAX_RECOMMENDED_OBJECT_SIZE = 1024 * 1024 * 1024
+
+MANIFEST_BUCKET_MARKER_TTL_SECONDS = 30 * 24 * 60 * 60
+
+# Manifests up to this size stay in memory, larger ones spill to disk and are uploaded in concurrent multipart.
+MANIFEST_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MANIFEST_TRANSFER_CONFIG = TransferConfig(multipart_threshold=MANIFEST_MULTIPART_THRESHOLD, max_concurrency=8)
 
 
 @dataclass
-class S3Manifest:
-    entries: List[S3ManifestEntry]
+class S3Object:
+    key: str
+    size: int
 
 
-def build_s3_manifest(object_summaries: List) -> S3Manifest:
+def extract_literal_prefix(pattern: str) -> str:
     """
-    Build `S3Manifest` object from S3 object summaries
+    Extract the longest literal prefix that every string matched by a regular expression (via `match`) starts with.
 
         Parameters:
-            object_summaries: list of object summary containing `bucket_name: str` and `key: str`
+            pattern: regular expression source
 
         Returns:
-             s3_manifest: S3Manifest object
+            literal_prefix: literal prefix of `pattern` (empty string if there is none)
     """
-    return S3Manifest(entries=[
-        S3ManifestEntry(url=f's3://{object_summary.bucket_name}/{object_summary.key}', mandatory=True)
-        for
-        object_summary
-        in
-        object_summaries
-    ])
+    # Alternation may apply to the whole pattern, so no prefix is guaranteed.
+    if '|' in pattern:
+        return ''
+
+    literal_chars = []
+    index = 1 if pattern.startswith('^') else 0
+
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\' and index + 1 < len(pattern) and not pattern[index + 1].isalnum():
+            # Escaped punctuation (e.g. `\/`) is still a literal character.
+            literal_chars.append(pattern[index + 1])
+            index += 2
+        elif char in '\\.^$*+?{}[]()':
+            break
+        else:
+            literal_chars.append(char)
+            index += 1
 
+    # The last literal character is optional when followed by `?`, `*` or `{0,...}`.
+    if literal_chars and index < len(pattern) and pattern[index] in '?*{':
+        literal_chars.pop()
 
-def get_object_summaries(
-        bucket,
+    return ''.join(literal_chars)
+
+
+def get_s3_objects(
+        s3_client,
+        bucket_name: str,
         prefix: str,
         regex_pattern: Pattern[str]
-) -> List:
+) -> List[S3Object]:
     """
-    Get S3 object summaries from S3 bucket with specific prefix and regular expression.
+    Get S3 objects (key and size) from S3 bucket with specific prefix and regular expression.
 
         Parameters:
-            bucket: S3 bucket resource
+            s3_client: S3 client
+            bucket_name: S3 bucket name to list objects from
             prefix: prefix used as S3 object filter
             regex_pattern: regular expression used as additional S3 object filter after using `prefix`
 
         Returns:
-            object_summaries: list of object summaries
+            s3_objects: list of S3 objects
     """
-    object_summaries = []
+    # Let S3 filter server-side by the literal part of `regex_pattern` when it narrows down `prefix`.
+    literal_prefix = extract_literal_prefix(regex_pattern.pattern)
+    if literal_prefix.startswith(prefix):
+        prefix = literal_prefix
 
-    for object_summary in bucket.objects.filter(Prefix=prefix):
-        if regex_pattern.match(object_summary.key):
-            object_summaries = [*object_summaries, object_summary]
+    s3_objects = []
 
-    return object_summaries
+    # Work on raw `Contents` of each page rather than `bucket.objects` to skip building `ObjectSummary` per key.
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+        s3_objects.extend(
+            S3Object(key=content['Key'], size=content['Size'])
+            for content
+            in page.get('Contents', ())
+            if regex_pattern.match(content['Key'])
+        )
 
+    return s3_objects
 
-def upload_object_summaries_as_manifest(
-        s3,
-        object_summaries: List,
+
+def warn_about_oversized_objects(bucket_name: str, s3_objects: List[S3Object]) -> None:
+    """
+    Print S3 objects too large for Redshift COPY to balance across slices. JSON objects cannot be split by byte range
+    without breaking records, so they have to be split upstream.
+
+        Parameters:
+            bucket_name: S3 bucket name containing `s3_objects`
+            s3_objects: list of S3 objects
+
+        Returns:
+            None
+    """
+    for s3_object in s3_objects:
+        if s3_object.size > MAX_RECOMMENDED_OBJECT_SIZE:
+            print(
+                f's3://{bucket_name}/{s3_object.key} has {s3_object.size} bytes which is larger than ' +
+                f'{MAX_RECOMMENDED_OBJECT_SIZE} bytes. Consider splitting it upstream for better COPY parallelism.'
+            )
+
+
+def upload_s3_objects_as_manifest(
+        s3_client,
+        bucket_name: str,
+        s3_objects: List[S3Object],
         manifest_bucket_name: str,
         manifest_key: str
 ) -> None:
     """
-    Upload Redshift manifest file created from S3 object summaries to particular S3 bucket
+    Upload Redshift manifest file created from S3 objects to particular S3 bucket
 
         Parameters:
-            s3: S3 resource
-            object_summaries: S3 object summaries
+            s3_client: S3 client
+            bucket_name: S3 bucket name containing `s3_objects`
+            s3_objects: S3 objects
             manifest_bucket_name: S3 bucket name used to store Redshift manifest file
             manifest_key: S3 bucket key used to store Redshift manifest file
 
         Returns:
             None
     """
-    s3_manifest: S3Manifest = build_s3_manifest(object_summaries)
-    serialized_manifest = json.dumps({
-        'entries': [
-            {
-                'url': entry.url,
-                'mandatory': entry.mandatory
-            }
-            for entry
-            in s3_manifest.entries
-        ]
-    })
-    manifest_bytes = bytes(serialized_manifest, 'utf-8')
-    obj = s3.Object(manifest_bucket_name, manifest_key)
-    obj.put(Body=manifest_bytes)
+    warn_about_oversized_objects(bucket_name, s3_objects)
+
+    with tempfile.SpooledTemporaryFile(max_size=MANIFEST_MULTIPART_THRESHOLD) as manifest_file:
+        # Write `{"entries": [...]}` entry by entry to avoid holding the whole serialized manifest in memory.
+        # https://docs.aws.amazon.com/redshift/latest/dg/loading-data-files-using-manifest.html
+        manifest_file.write(b'{"entries":[')
+        for index, s3_object in enumerate(s3_objects):
+            if index > 0:
+                manifest_file.write(b',')
+            manifest_file.write(orjson.dumps({
+                'url': f's3://{bucket_name}/{s3_object.key}',
+                'mandatory': True,
+                'meta': {
+                    'content_length': s3_object.size
+                }
+            }))
+        manifest_file.write(b']}')
+        manifest_file.seek(0)
+        s3_client.upload_fileobj(manifest_file, manifest_bucket_name, manifest_key, Config=MANIFEST_TRANSFER_CONFIG)
 
 
-def build_and_upload_manifest_file(
-        s3,
-        etl_config: EtlConfig
-) -> None:
+def create_manifest_bucket_if_not_exists(s3, etl_config: EtlConfig) -> None:
     """
-    Build and upload manifest file to S3 bucket according to predefined ETL configuration
+    Create S3 bucket used to store Redshift manifest files if it does not exist yet
 
         Parameters:
             s3: S3 resource
@@ -131,34 +195,122 @@ def build_and_upload_manifest_file(
         else:
             raise manifest_bucket_validation_error
 
-    dataset_bucket = s3.Bucket(etl_config.data_set.bucket_name)
-
-    song_data_object_summaries = get_object_summaries(
-        bucket=dataset_bucket,
-        prefix=etl_config.data_set.song_data_prefix,
-        regex_pattern=etl_config.data_set.song_data_regex_pattern
-    )
-    log_data_object_summaries = get_object_summaries(
-        bucket=dataset_bucket,
-        prefix=etl_config.data_set.log_data_prefix,
-        regex_pattern=etl_config.data_set.log_data_regex_pattern
-    )
-    upload_object_summaries_as_manifest(
-        s3,
-        song_data_object_summaries,
-        manifest_bucket_name=etl_config.manifest.bucket_name,
-        manifest_key=etl_config.manifest.song_data_key
-    )
-    upload_object_summaries_as_manifest(
+
+def get_manifest_bucket_marker_path(manifest_bucket_name: str) -> str:
+    digest = hashlib.sha256(manifest_bucket_name.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, 'manifest_bucket_ok', digest)
+
+
+def prepare_manifest_bucket(s3, etl_config: EtlConfig) -> None:
+    """
+    Make sure S3 bucket used to store Redshift manifest files exists. Once verified, the check is skipped
+    for `MANIFEST_BUCKET_MARKER_TTL_SECONDS` thanks to local marker file.
+
+        Parameters:
+            s3: S3 resource
+            etl_config: ETL application configuration
+
+        Returns:
+            None
+    """
+    marker_path = get_manifest_bucket_marker_path(etl_config.manifest.bucket_name)
+    if os.path.exists(marker_path) and time.time() - os.path.getmtime(marker_path) < MANIFEST_BUCKET_MARKER_TTL_SECONDS:
+        return
+
+    create_manifest_bucket_if_not_exists(s3, etl_config)
+
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    with open(marker_path, 'w'):
+        pass
+
+
+def invalidate_manifest_bucket_marker(manifest_bucket_name: str) -> None:
+    marker_path = get_manifest_bucket_marker_path(manifest_bucket_name)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def build_and_upload_manifest_file(
         s3,
-        log_data_object_summaries,
-        manifest_bucket_name=etl_config.manifest.bucket_name,
-        manifest_key=etl_config.manifest.event_data_key
-    )
+        etl_config: EtlConfig
+) -> None:
+    """
+    Build and upload manifest file to S3 bucket according to predefined ETL configuration
+
+        Parameters:
+            s3: S3 resource
+            etl_config: ETL application configuration
+
+        Returns:
+            None
+    """
+    prepare_manifest_bucket(s3, etl_config)
+
+    # Both listings (and then both uploads) are I/O-bound, so let them overlap.
+    # Unlike resources, boto3 clients are thread-safe, hence all jobs share the client behind `s3` resource.
+    s3_client = s3.meta.client
+    listing_jobs = [
+        (
+            etl_config.data_set.song_data_prefix,
+            etl_config.data_set.song_data_regex,
+            etl_config.manifest.song_data_key
+        ),
+        (
+            etl_config.data_set.log_data_prefix,
+            etl_config.data_set.log_data_regex,
+            etl_config.manifest.event_data_key
+        )
+    ]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        manifest_key_by_listing_future = {
+            executor.submit(
+                get_s3_objects,
+                s3_client,
+                bucket_name=etl_config.data_set.bucket_name,
+                prefix=prefix,
+                regex_pattern=regex_pattern
+            ): manifest_key
+            for prefix, regex_pattern, manifest_key
+            in listing_jobs
+        }
+
+        upload_jobs = {}
+        for listing_future in as_completed(manifest_key_by_listing_future):
+            s3_objects = listing_future.result()
+            manifest_key = manifest_key_by_listing_future[listing_future]
+            upload_future = executor.submit(
+                upload_s3_objects_as_manifest,
+                s3_client,
+                bucket_name=etl_config.data_set.bucket_name,
+                s3_objects=s3_objects,
+                manifest_bucket_name=etl_config.manifest.bucket_name,
+                manifest_key=manifest_key
+            )
+            upload_jobs[upload_future] = (s3_objects, manifest_key)
+
+        for upload_future, (s3_objects, manifest_key) in upload_jobs.items():
+            try:
+                upload_future.result()
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchBucket':
+                    raise e
+
+                # Manifest bucket is gone since the marker was written. Verify it again and retry once.
+                print(f'Manifest bucket {etl_config.manifest.bucket_name} is not found. Re-create it and retry.')
+                invalidate_manifest_bucket_marker(etl_config.manifest.bucket_name)
+                prepare_manifest_bucket(s3, etl_config)
+                upload_s3_objects_as_manifest(
+                    s3_client,
+                    bucket_name=etl_config.data_set.bucket_name,
+                    s3_objects=s3_objects,
+                    manifest_bucket_name=etl_config.manifest.bucket_name,
+                    manifest_key=manifest_key
+                )
 
 
 def main() -> None:
-    s3 = boto3.resource('s3')
+    s3 = get_s3_resource()
     etl_config = get_static_config_instance()
     build_and_upload_manifest_file(s3, etl_config)
 
@@ -0,0 +1,32 @@
+import argparse
+
+import psycopg2
+
+from common import configure_logging, get_dwh_conn_string, get_static_config_instance, EtlConfig
+from create_tables import recreate_tables
+from etl import add_etl_arguments, run_etl
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Re-create tables, then load data from S3 to Redshift staging tables and final tables'
+    )
+    add_etl_arguments(parser)
+    args = parser.parse_args()
+
+    configure_logging()
+    etl_config: EtlConfig = get_static_config_instance()
+
+    # Re-create tables and load staging tables on one connection. Final tables are inserted concurrently
+    # on pooled connections which `run_etl` opens only after staging tables are loaded.
+    conn_string = get_dwh_conn_string(etl_config)
+    conn = psycopg2.connect(conn_string)
+    try:
+        recreate_tables(conn)
+        run_etl(conn, conn_string, etl_config=etl_config, refresh_iam=args.refresh_iam)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@ import json
 import time
 from dataclasses import dataclass
 
-import boto3
 import botocore.exceptions
 import psycopg2
 
-from common import get_static_config_instance, EtlConfig
+from common import (
+    build_conn_string,
+    get_ec2_resource,
+    get_iam_client,
+    get_redshift_client,
+    get_static_config_instance,
+    EtlConfig
+)
 
 
 @dataclass
@@ -89,22 +95,17 @@ def spin_up_and_wait_redshift_cluster(
         IamRoles=[dwh_iam_role_arn]
     )
 
-    def get_available_cluster_props():
-        cp = redshift_client.describe_clusters(
-            ClusterIdentifier=etl_config.redshift_cluster.cluster_identifier
-        )['Clusters'][0]
-
-        cluster_status = cp['ClusterStatus']
-
-        if cluster_status.lower() == 'available':
-            return cp
-        else:
-            identifier = etl_config.redshift_cluster.cluster_identifier
-            print(f"Redshift cluster with identifier = {identifier} is {cluster_status}. Let's wait for 5 seconds.")
-            time.sleep(5)
-            return get_available_cluster_props()
+    identifier = etl_config.redshift_cluster.cluster_identifier
+    print(f'Waiting for Redshift cluster with identifier = {identifier} to be available.')
+    redshift_client.get_waiter('cluster_available').wait(
+        ClusterIdentifier=identifier,
+        WaiterConfig={
+            'Delay': 15,
+            'MaxAttempts': 120
+        }
+    )
 
-    cluster_props = get_available_cluster_props()
+    cluster_props = redshift_client.describe_clusters(ClusterIdentifier=identifier)['Clusters'][0]
 
     return RedshiftClusterMetadata(
         endpoint=cluster_props['Endpoint']['Address'],
@@ -150,13 +151,7 @@ def open_and_verify_tcp_connection(
 
     conn = None
     try:
-        conn_string = 'host={endpoint} dbname={db_name} user={db_user} password={db_password} port={db_port}'.format(
-            db_user=etl_config.redshift_cluster.db_user,
-            db_password=etl_config.redshift_cluster.db_password,
-            endpoint=cluster_metadata.endpoint,
-            db_port=etl_config.redshift_cluster.db_port,
-            db_name=etl_config.redshift_cluster.db_name
-        )
+        conn_string = build_conn_string(etl_config, cluster_endpoint=cluster_metadata.endpoint)
         conn = psycopg2.connect(conn_string)
         print(
             f'Successfully create connection to DB with endpoint = {cluster_metadata.endpoint}, ' +
@@ -173,9 +168,9 @@ def open_and_verify_tcp_connection(
 def main() -> None:
     etl_config = get_static_config_instance()
 
-    iam_client = boto3.client('iam')
-    redshift_client = boto3.client('redshift')
-    ec2_resource = boto3.resource('ec2')
+    iam_client = get_iam_client()
+    redshift_client = get_redshift_client()
+    ec2_resource = get_ec2_resource()
 
     dwh_iam_role_arn = prepare_dwh_iam_role_arn(
         iam_client,
@@ -71,8 +71,8 @@ staging_songs_table_create = ('''
 songplay_table_create = ('''
     CREATE TABLE songplays (
         songplay_id BIGINT    NOT NULL IDENTITY(1, 1),
-        start_time  TIMESTAMP NOT NULL,
-        user_id     TEXT      NULL,
+        start_time  TIMESTAMP NOT NULL SORTKEY,
+        user_id     TEXT      NULL DISTKEY,
         level       TEXT      NULL,
         song_id     TEXT      NULL,
         artist_id   TEXT      NULL,
@@ -140,12 +140,17 @@ time_table_create = ('''
 def build_copy_table_queries(etl_config: EtlConfig, dwh_iam_role_arn: str) -> List[str]:
     # Since we deal timestamp in `epochmillisecs` unit, we can apply that data conversion during COPY operation.
     # Ref: https://docs.aws.amazon.com/redshift/latest/dg/copy-parameters-data-conversion.html#copy-timeformat
+    # Staging tables are recreated on every run, so skip automatic compression analysis and statistics update.
+    # Ref: https://docs.aws.amazon.com/redshift/latest/dg/copy-parameters-data-load.html
     staging_events_copy = ('''
         copy staging_events
         from 's3://{manifest_bucket_name}/{event_data_manifest_key}'
         credentials 'aws_iam_role={iam_role_arn}'
         format as json 's3://{data_set_bucket_name}/{data_set_event_data_json_path_key}'
         timeformat as 'epochmillisecs'
+        {compression}
+        compupdate off
+        statupdate off
         region '{region}'
         manifest;
     ''').format(
@@ -154,20 +159,25 @@ def build_copy_table_queries(etl_config: EtlConfig, dwh_iam_role_arn: str) -> Li
         iam_role_arn=dwh_iam_role_arn,
         region=etl_config.region_name,
         data_set_bucket_name=etl_config.data_set.bucket_name,
-        data_set_event_data_json_path_key=etl_config.data_set.log_data_json_path_key
+        data_set_event_data_json_path_key=etl_config.data_set.log_data_json_path_key,
+        compression=etl_config.data_set.compression
     )
     staging_songs_copy = ('''
         copy staging_songs
         from 's3://{manifest_bucket_name}/{song_data_manifest_key}'
         credentials 'aws_iam_role={iam_role_arn}'
         format as json 'auto'
+        {compression}
+        compupdate off
+        statupdate off
         region '{region}'
         manifest;
     ''').format(
         manifest_bucket_name=etl_config.manifest.bucket_name,
         song_data_manifest_key=etl_config.manifest.song_data_key,
         iam_role_arn=dwh_iam_role_arn,
-        region=etl_config.region_name
+        region=etl_config.region_name,
+        compression=etl_config.data_set.compression
     )
     copy_table_queries = [
         staging_events_copy,
@@ -203,7 +213,8 @@ songplay_table_insert = ('''
     JOIN songs s
         ON (s.title = se.song AND s.duration = se.length)
     JOIN artists a
-        ON a.name = se.artist
+        ON (a.artist_id = s.artist_id AND a.name = se.artist)
+    WHERE se.page = 'NextSong' AND se.ts IS NOT NULL
 ''')
 
 user_table_insert = ('''
@@ -302,10 +313,18 @@ drop_table_queries = [
     staging_songs_table_drop,
     staging_events_table_drop
 ]
-insert_table_queries = [
+# Dimension inserts only read staging tables, so they are independent of each other.
+dimension_table_insert_queries = [
     user_table_insert,
     artist_table_insert,
     time_table_insert,
-    song_table_insert,
+    song_table_insert
+]
+# Fact inserts join dimension tables, so they must run after `dimension_table_insert_queries`.
+fact_table_insert_queries = [
     songplay_table_insert
 ]
+insert_table_queries = [
+    *dimension_table_insert_queries,
+    *fact_table_insert_queries
+]
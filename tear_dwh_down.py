@@ -1,8 +1,6 @@
 import time
 
-import boto3
-
-from common import get_static_config_instance, EtlConfig
+from common import get_redshift_client, get_static_config_instance, EtlConfig
 
 
 def poll_until_cluster_not_found(redshift_client, cluster_identifier: str) -> None:
@@ -22,7 +20,7 @@ def poll_until_cluster_not_found(redshift_client, cluster_identifier: str) -> No
 def main() -> None:
     etl_config: EtlConfig = get_static_config_instance()
 
-    redshift_client = boto3.client('redshift')
+    redshift_client = get_redshift_client()
 
     redshift_client.delete_cluster(
         ClusterIdentifier=etl_config.redshift_cluster.cluster_identifier,